@@ -1,16 +1,20 @@
 import os
 import logging
 import asyncio
-import pandas as pd
-import requests
-from typing import List, Dict, Optional
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+import httpx
+import orjson
+from typing import List, Dict, Optional, TextIO, Iterator
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, Response
+from pydantic import BaseModel, conint
 from dotenv import load_dotenv
-import aiofiles
-import tempfile
-import re
+from cachetools import TTLCache
+from tenacity import retry, retry_if_result, stop_after_attempt, wait_exponential
+import io
+import uuid
+import string
+import csv
 
 # Load environment variables
 load_dotenv()
@@ -19,7 +23,7 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="CSV Contact Manager Agent")
+app = FastAPI(title="CSV Contact Manager Agent", default_response_class=ORJSONResponse)
 
 # Configuration
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -28,6 +32,14 @@ MAILCHIMP_LIST_ID = os.getenv("MAILCHIMP_LIST_ID")
 MAILCHIMP_SERVER_PREFIX = os.getenv("MAILCHIMP_SERVER_PREFIX")
 PIPEDRIVE_API_KEY = os.getenv("PIPEDRIVE_API_KEY")
 PIPEDRIVE_DOMAIN = os.getenv("PIPEDRIVE_DOMAIN")
+MAX_CONTACTS = int(os.getenv("MAX_CONTACTS", 10000))
+
+# Mailchimp accepts at most 500 members per batch subscribe request
+MAILCHIMP_BATCH_SIZE = 500
+
+# Cap concurrent requests per third-party API to stay under their rate limits
+MAILCHIMP_SEM = asyncio.Semaphore(10)
+PIPEDRIVE_SEM = asyncio.Semaphore(20)
 
 # Data models
 class Contact(BaseModel):
@@ -39,12 +51,83 @@ class Contact(BaseModel):
 
 class ContactReview(BaseModel):
     session_id: str
-    contact_index: int
+    contact_index: conint(ge=0)
+    add_to_mailchimp: bool
+    add_to_pipedrive: bool
+
+class BulkReview(BaseModel):
+    session_id: str
+    contact_indices: List[conint(ge=0)]
     add_to_mailchimp: bool
     add_to_pipedrive: bool
 
-# In-memory storage for active reviews (in production, use Redis/database)
-active_reviews: Dict[str, List[Contact]] = {}
+CONTACT_FIELDS = tuple(Contact.model_fields)
+
+# In-memory storage for active reviews (in production, use Redis/database).
+# Each entry holds the contacts column-wise (one list per field) under
+# "columns", plus the serialized /contacts response under "contacts_json" once
+# it has been requested; sessions are never modified after upload, so those
+# bytes stay valid. Sessions expire after an hour without activity so memory
+# stays bounded.
+active_reviews: Dict[str, Dict] = TTLCache(maxsize=512, ttl=3600)
+
+def contact_count(columns: Dict[str, List]) -> int:
+    return len(columns[CONTACT_FIELDS[0]])
+
+def contact_row(columns: Dict[str, List], index: int) -> Dict:
+    """Rebuild a single contact dict from the columns"""
+    return {field: columns[field][index] for field in CONTACT_FIELDS}
+
+def contact_rows(columns: Dict[str, List], stop: Optional[int] = None) -> List[Dict]:
+    """Rebuild contact dicts from the columns, optionally only the first `stop`"""
+    return [
+        dict(zip(CONTACT_FIELDS, row))
+        for row in zip(*(columns[field][:stop] for field in CONTACT_FIELDS))
+    ]
+
+def get_review_entry(session_id: str) -> Optional[Dict]:
+    """Return a review session's stored entry and restart its expiry timer"""
+    entry = active_reviews.get(session_id) if session_id else None
+    if entry is not None:
+        # TTLCache expiry counts from insertion, so re-insert to keep it alive
+        active_reviews[session_id] = entry
+    return entry
+
+def get_review_session(session_id: str) -> Optional[Dict[str, List]]:
+    """Return a review session's columns and restart its expiry timer"""
+    entry = get_review_entry(session_id)
+    return entry["columns"] if entry is not None else None
+
+def create_review_session(columns: Dict[str, List]) -> str:
+    """Store parsed contact columns under a new review session ID"""
+    session_id = str(uuid.uuid4())
+    active_reviews[session_id] = {"columns": columns, "contacts_json": None}
+    return session_id
+
+def http_client() -> httpx.AsyncClient:
+    """Return the shared HTTP client, creating it on first use"""
+    # Shared so Mailchimp/Pipedrive calls reuse keep-alive connections, and
+    # lazy so they also work when the bot calls them without the server running
+    client = getattr(app.state, "http", None)
+    if client is None or client.is_closed:
+        client = app.state.http = httpx.AsyncClient(
+            timeout=10,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+        )
+    return client
+
+async def close_http_client():
+    client = getattr(app.state, "http", None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+@app.on_event("startup")
+async def startup():
+    http_client()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_http_client()
 
 @app.get("/")
 async def root():
@@ -54,48 +137,72 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+# Character sets equivalent to ^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$
+EMAIL_LOCAL_CHARS = frozenset(string.ascii_letters + string.digits + '._%+-')
+EMAIL_DOMAIN_CHARS = frozenset(string.ascii_letters + string.digits + '.-')
+EMAIL_TLD_CHARS = frozenset(string.ascii_letters)
+
 def validate_email(email: str) -> bool:
     """Basic email validation"""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
-
-def validate_linkedin_url(url: str) -> bool:
-    """Basic LinkedIn URL validation"""
-    if not url or pd.isna(url):
+    local, sep, domain = email.partition('@')
+    if not sep or not local:
         return False
-    url = str(url).strip()
-    return 'linkedin.com' in url.lower()
+    
+    # The TLD follows the last dot and needs at least two letters
+    dot = domain.rfind('.')
+    if dot < 1 or len(domain) - dot < 3:
+        return False
+    
+    return (
+        EMAIL_LOCAL_CHARS.issuperset(local)
+        and EMAIL_DOMAIN_CHARS.issuperset(domain)
+        and EMAIL_TLD_CHARS.issuperset(domain[dot + 1:])
+    )
 
-def clean_linkedin_url(url: str) -> str:
-    """Clean and standardize LinkedIn URL"""
-    if not url or pd.isna(url):
-        return ""
+def normalize_linkedin_url(url: Optional[str]) -> Optional[str]:
+    """Clean and standardize a LinkedIn URL, or return None if it isn't one"""
+    if not url:
+        return None
     
-    url = str(url).strip()
+    url = url.strip()
     
     # Remove tracking parameters
-    if '?' in url:
-        url = url.split('?')[0]
+    query = url.find('?')
+    if query >= 0:
+        url = url[:query]
     
-    # Ensure it starts with https://
-    if not url.startswith('http'):
+    if 'linkedin.com' not in url.lower():
+        return None
+    
+    # Ensure it has a scheme
+    if not url.startswith(('http://', 'https://')):
         url = 'https://' + url
     
     return url
 
-def parse_csv(file_path: str) -> List[Contact]:
-    """Parse CSV file and extract contacts"""
+def parse_csv_columns(f: TextIO, limit: Optional[int] = None) -> Dict[str, List]:
+    """Parse CSV rows from an open text stream into per-field contact lists"""
+    columns = {field: [] for field in CONTACT_FIELDS}
+    
+    for fields in iter_contact_fields(f, limit):
+        for field in CONTACT_FIELDS:
+            columns[field].append(fields[field])
+    
+    return columns
+
+def iter_contact_fields(f: TextIO, limit: Optional[int] = None) -> Iterator[Dict]:
+    """Yield the fields of each valid contact in a CSV stream, stopping after `limit`"""
     try:
-        df = pd.read_csv(file_path)
-        contacts = []
+        count = 0
+        reader = csv.DictReader(f)
         
-        for _, row in df.iterrows():
+        for row in reader:
             # Extract required fields
-            name = str(row.get('name', '')).strip()
-            email = str(row.get('email', '')).strip()
-            linkedin_url = clean_linkedin_url(row.get('What is your LinkedIn profile?', ''))
+            name = (row.get('name') or '').strip()
+            email = (row.get('email') or '').strip()
+            linkedin_url = normalize_linkedin_url(row.get('What is your LinkedIn profile?'))
             
-            # Skip if missing essential data
+            # Skip if missing essential data or the LinkedIn URL is invalid
             if not name or not email or not linkedin_url:
                 continue
             
@@ -103,29 +210,55 @@ def parse_csv(file_path: str) -> List[Contact]:
             if not validate_email(email):
                 continue
             
-            # Validate LinkedIn URL
-            if not validate_linkedin_url(linkedin_url):
-                continue
-            
             # Extract first and last name
-            first_name = str(row.get('first_name', '')).strip() if pd.notna(row.get('first_name')) else ""
-            last_name = str(row.get('last_name', '')).strip() if pd.notna(row.get('last_name')) else ""
+            first_name = (row.get('first_name') or '').strip()
+            last_name = (row.get('last_name') or '').strip()
             
-            contact = Contact(
-                name=name,
-                email=email,
-                linkedin_url=linkedin_url,
-                first_name=first_name if first_name else None,
-                last_name=last_name if last_name else None
-            )
-            contacts.append(contact)
-        
-        return contacts
+            yield {
+                "name": name,
+                "email": email,
+                "linkedin_url": linkedin_url,
+                "first_name": first_name if first_name else None,
+                "last_name": last_name if last_name else None
+            }
+            
+            count += 1
+            if limit is not None and count >= limit:
+                break
     
     except Exception as e:
         logger.error(f"Error parsing CSV: {e}")
         raise HTTPException(status_code=400, detail=f"Error parsing CSV: {str(e)}")
 
+@retry(
+    retry=retry_if_result(lambda response: response.status_code == 429),
+    wait=wait_exponential(multiplier=0.5, max=30),
+    stop=stop_after_attempt(5),
+    retry_error_callback=lambda state: state.outcome.result()
+)
+async def post_with_backoff(semaphore: asyncio.Semaphore, url: str, **kwargs) -> httpx.Response:
+    """POST through the shared client, backing off while the API returns 429"""
+    async with semaphore:
+        return await http_client().post(url, **kwargs)
+
+def mailchimp_member(contact: Contact) -> Dict:
+    """Build the Mailchimp member payload for a contact"""
+    return {
+        "email_address": contact.email,
+        "status": "subscribed",
+        "merge_fields": {
+            "FNAME": contact.first_name or contact.name.split()[0],
+            "LNAME": contact.last_name or " ".join(contact.name.split()[1:]) if len(contact.name.split()) > 1 else "",
+            "LINKEDIN": contact.linkedin_url
+        }
+    }
+
+def mailchimp_headers() -> Dict:
+    return {
+        "Authorization": f"Bearer {MAILCHIMP_API_KEY}",
+        "Content-Type": "application/json"
+    }
+
 async def add_to_mailchimp(contact: Contact) -> bool:
     """Add contact to Mailchimp"""
     if not all([MAILCHIMP_API_KEY, MAILCHIMP_LIST_ID, MAILCHIMP_SERVER_PREFIX]):
@@ -135,22 +268,10 @@ async def add_to_mailchimp(contact: Contact) -> bool:
     try:
         url = f"https://{MAILCHIMP_SERVER_PREFIX}.api.mailchimp.com/3.0/lists/{MAILCHIMP_LIST_ID}/members"
         
-        data = {
-            "email_address": contact.email,
-            "status": "subscribed",
-            "merge_fields": {
-                "FNAME": contact.first_name or contact.name.split()[0],
-                "LNAME": contact.last_name or " ".join(contact.name.split()[1:]) if len(contact.name.split()) > 1 else "",
-                "LINKEDIN": contact.linkedin_url
-            }
-        }
+        data = mailchimp_member(contact)
+        headers = mailchimp_headers()
         
-        headers = {
-            "Authorization": f"Bearer {MAILCHIMP_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        response = requests.post(url, json=data, headers=headers)
+        response = await post_with_backoff(MAILCHIMP_SEM, url, json=data, headers=headers)
         
         if response.status_code in [200, 201]:
             logger.info(f"Successfully added {contact.email} to Mailchimp")
@@ -182,7 +303,7 @@ async def add_to_pipedrive(contact: Contact) -> bool:
         headers = {"Content-Type": "application/json"}
         params = {"api_token": PIPEDRIVE_API_KEY}
         
-        response = requests.post(person_url, json=person_data, headers=headers, params=params)
+        response = await post_with_backoff(PIPEDRIVE_SEM, person_url, json=person_data, headers=headers, params=params)
         
         if response.status_code == 201:
             person_id = response.json()["data"]["id"]
@@ -196,37 +317,75 @@ async def add_to_pipedrive(contact: Contact) -> bool:
         logger.error(f"Error adding to Pipedrive: {e}")
         return False
 
+async def add_many_to_mailchimp(contacts: List[Contact]) -> List[bool]:
+    """Add contacts to Mailchimp using batch subscribe requests"""
+    if not all([MAILCHIMP_API_KEY, MAILCHIMP_LIST_ID, MAILCHIMP_SERVER_PREFIX]):
+        logger.warning("Mailchimp credentials not configured")
+        return [False] * len(contacts)
+    
+    url = f"https://{MAILCHIMP_SERVER_PREFIX}.api.mailchimp.com/3.0/lists/{MAILCHIMP_LIST_ID}"
+    headers = mailchimp_headers()
+    results = []
+    
+    for start in range(0, len(contacts), MAILCHIMP_BATCH_SIZE):
+        chunk = contacts[start:start + MAILCHIMP_BATCH_SIZE]
+        data = {
+            "members": [mailchimp_member(contact) for contact in chunk],
+            "update_existing": False
+        }
+        
+        try:
+            response = await post_with_backoff(MAILCHIMP_SEM, url, json=data, headers=headers)
+            
+            if response.status_code == 200:
+                errors = response.json().get("errors", [])
+                for error in errors:
+                    logger.error(f"Failed to add {error['email_address']} to Mailchimp: {error.get('error')}")
+                failed = {error["email_address"].lower() for error in errors}
+                results.extend(contact.email.lower() not in failed for contact in chunk)
+                logger.info(f"Batch added {len(chunk) - len(failed)} contacts to Mailchimp")
+            else:
+                logger.error(f"Failed to batch add contacts to Mailchimp: {response.text}")
+                results.extend([False] * len(chunk))
+        
+        except Exception as e:
+            logger.error(f"Error batch adding to Mailchimp: {e}")
+            results.extend([False] * len(chunk))
+    
+    return results
+
+async def add_many_to_pipedrive(contacts: List[Contact]) -> List[bool]:
+    """Add contacts to Pipedrive concurrently, bounded by PIPEDRIVE_SEM"""
+    return await asyncio.gather(*(add_to_pipedrive(contact) for contact in contacts))
+
 @app.post("/upload-csv")
-async def upload_csv(file: UploadFile = File(...)):
+async def upload_csv(
+    file: UploadFile = File(...),
+    limit: int = Query(MAX_CONTACTS, ge=1, le=MAX_CONTACTS, description="Maximum number of contacts to parse")
+):
     """Upload and parse CSV file"""
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="File must be a CSV")
     
     try:
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as temp_file:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-        
-        # Parse CSV
-        contacts = parse_csv(temp_file_path)
+        # Parse straight from the spooled upload instead of copying it to disk
+        # Parsing is CPU-bound, so keep it off the event loop
+        stream = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+        try:
+            columns = await run_in_threadpool(parse_csv_columns, stream, limit)
+        finally:
+            # Leave file.file open for UploadFile to close
+            stream.detach()
         
-        # Clean up temp file
-        os.unlink(temp_file_path)
-        
-        if not contacts:
+        if not contact_count(columns):
             raise HTTPException(status_code=400, detail="No valid contacts found in CSV")
         
-        # Generate review session ID
-        import uuid
-        session_id = str(uuid.uuid4())
-        active_reviews[session_id] = contacts
+        session_id = create_review_session(columns)
         
         return {
             "session_id": session_id,
-            "total_contacts": len(contacts),
-            "contacts": [contact.dict() for contact in contacts[:5]]  # Show first 5 as preview
+            "total_contacts": contact_count(columns),
+            "contacts": contact_rows(columns, 5)  # Show first 5 as preview
         }
     
     except Exception as e:
@@ -238,45 +397,103 @@ async def review_contact(review: ContactReview):
     """Review and process a single contact"""
     session_id = review.session_id
     
-    if not session_id or session_id not in active_reviews:
+    columns = get_review_session(session_id)
+    if columns is None:
         raise HTTPException(status_code=404, detail="Review session not found")
     
-    contacts = active_reviews[session_id]
-    
-    if review.contact_index >= len(contacts):
+    if review.contact_index >= contact_count(columns):
         raise HTTPException(status_code=400, detail="Invalid contact index")
     
-    contact = contacts[review.contact_index]
-    results = {}
+    row = contact_row(columns, review.contact_index)
+    contact = Contact(**row)
+    tasks = []
+    keys = []
     
     # Add to Mailchimp if requested
     if review.add_to_mailchimp:
-        results["mailchimp"] = await add_to_mailchimp(contact)
+        tasks.append(add_to_mailchimp(contact))
+        keys.append("mailchimp")
     
     # Add to Pipedrive if requested
     if review.add_to_pipedrive:
-        results["pipedrive"] = await add_to_pipedrive(contact)
+        tasks.append(add_to_pipedrive(contact))
+        keys.append("pipedrive")
+    
+    # Run the independent service calls concurrently
+    done = await asyncio.gather(*tasks, return_exceptions=True)
+    results = {}
+    for key, outcome in zip(keys, done):
+        if isinstance(outcome, Exception):
+            logger.error(f"Error adding to {key}: {outcome}")
+            outcome = False
+        results[key] = outcome
     
     return {
-        "contact": contact.dict(),
+        "contact": row,
         "results": results,
         "processed": True
     }
 
-@app.get("/contacts/{session_id}")
-async def get_contacts(session_id: str):
-    """Get all contacts for a review session"""
-    if session_id not in active_reviews:
+@app.post("/bulk-review")
+async def bulk_review(review: BulkReview):
+    """Review and process several contacts at once"""
+    session_id = review.session_id
+    
+    columns = get_review_session(session_id)
+    if columns is None:
         raise HTTPException(status_code=404, detail="Review session not found")
+    indices = list(dict.fromkeys(review.contact_indices))
+    
+    if any(index >= contact_count(columns) for index in indices):
+        raise HTTPException(status_code=400, detail="Invalid contact index")
+    
+    selected = [Contact(**contact_row(columns, index)) for index in indices]
+    tasks = []
+    keys = []
+    
+    if review.add_to_mailchimp:
+        tasks.append(add_many_to_mailchimp(selected))
+        keys.append("mailchimp")
+    
+    if review.add_to_pipedrive:
+        tasks.append(add_many_to_pipedrive(selected))
+        keys.append("pipedrive")
+    
+    done = await asyncio.gather(*tasks)
     
-    contacts = active_reviews[session_id]
     return {
         "session_id": session_id,
-        "total_contacts": len(contacts),
-        "contacts": [contact.dict() for contact in contacts]
+        "results": [
+            {
+                "contact_index": index,
+                "results": {key: outcomes[i] for key, outcomes in zip(keys, done)}
+            }
+            for i, index in enumerate(indices)
+        ],
+        "processed": True
     }
 
+@app.get("/contacts/{session_id}")
+async def get_contacts(session_id: str):
+    """Get all contacts for a review session"""
+    entry = get_review_entry(session_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Review session not found")
+    
+    if entry["contacts_json"] is None:
+        columns = entry["columns"]
+        entry["contacts_json"] = orjson.dumps({
+            "session_id": session_id,
+            "total_contacts": contact_count(columns),
+            "contacts": contact_rows(columns)
+        })
+    
+    return Response(content=entry["contacts_json"], media_type="application/json")
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port) 
\ No newline at end of file
+    # Review sessions live in process memory, so this must stay a single
+    # worker until they move to a shared store.
+    # "auto" picks uvloop and httptools when installed (not available on Windows)
+    uvicorn.run(app, host="0.0.0.0", port=port, loop="auto", http="auto") 
\ No newline at end of file
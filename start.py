@@ -1,34 +1,21 @@
 import asyncio
-import subprocess
-import sys
 import os
+import uvicorn
 from dotenv import load_dotenv
 
+try:
+    import uvloop
+except ImportError:  # Not available on Windows
+    uvloop = None
+
 # Load environment variables
 load_dotenv()
 
-async def run_api_server():
-    """Run the FastAPI server"""
-    print("🚀 Starting FastAPI server...")
-    process = await asyncio.create_subprocess_exec(
-        sys.executable, "main.py",
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    return process
-
-async def run_telegram_bot():
-    """Run the Telegram bot"""
-    print("🤖 Starting Telegram bot...")
-    process = await asyncio.create_subprocess_exec(
-        sys.executable, "telegram_bot.py",
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE
-    )
-    return process
+from main import app
+from telegram_bot import ContactManagerBot
 
 async def main():
-    """Run both services concurrently"""
+    """Run the API server and the Telegram bot in one process"""
     print("🎯 Starting CSV Contact Manager Agent...")
     
     # Check if required environment variables are set
@@ -40,25 +27,24 @@ async def main():
         print("Please set them in your .env file or environment")
         return
     
-    # Start both services
-    api_process = await run_api_server()
-    bot_process = await run_telegram_bot()
+    port = int(os.getenv("PORT", 8000))
+    server = uvicorn.Server(uvicorn.Config(app, host="0.0.0.0", port=port, http="auto"))
+    bot = ContactManagerBot()
     
-    try:
-        # Wait for both processes
-        await asyncio.gather(
-            api_process.wait(),
-            bot_process.wait()
-        )
-    except KeyboardInterrupt:
+    async with asyncio.TaskGroup() as tg:
+        print("🤖 Starting Telegram bot...")
+        bot_task = tg.create_task(bot.serve())
+        
+        # The server handles SIGINT/SIGTERM; stop the bot once it exits
+        print("🚀 Starting FastAPI server...")
+        await server.serve()
         print("\n🛑 Shutting down services...")
-        api_process.terminate()
-        bot_process.terminate()
-        await asyncio.gather(
-            api_process.wait(),
-            bot_process.wait()
-        )
-        print("✅ Services stopped")
+        bot_task.cancel()
+    
+    print("✅ Services stopped")
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    # Server.serve() doesn't set up uvicorn's event loop, so pick uvloop here
+    loop_factory = uvloop.new_event_loop if uvloop else None
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        runner.run(main())
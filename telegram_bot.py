@@ -1,13 +1,16 @@
 import os
 import logging
 import asyncio
-import aiohttp
-import tempfile
+import io
 from typing import Dict, List
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
 from dotenv import load_dotenv
-import pandas as pd
+from cachetools import TTLCache
+from main import (
+    ContactReview, MAX_CONTACTS, parse_csv_columns, create_review_session,
+    get_review_session, contact_count, contact_row, review_contact, close_http_client
+)
 
 # Load environment variables
 load_dotenv()
@@ -18,16 +21,26 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
 
-# Store active sessions for each user
-user_sessions: Dict[int, Dict] = {}
+# Store active sessions for each user, expiring reviews idle for over an hour
+user_sessions: Dict[int, Dict] = TTLCache(maxsize=1024, ttl=3600)
+
+SESSION_EXPIRED_MESSAGE = "⌛ This review session expired after an hour without activity. Please upload the CSV file again."
 
 class ContactManagerBot:
     def __init__(self):
-        self.application = Application.builder().token(TELEGRAM_TOKEN).build()
+        self.application = (
+            Application.builder()
+            .token(TELEGRAM_TOKEN)
+            .post_shutdown(self._close_session)
+            .build()
+        )
         self.setup_handlers()
     
+    async def _close_session(self, application: Application):
+        """Close the shared HTTP client on shutdown"""
+        await close_http_client()
+    
     def setup_handlers(self):
         """Setup bot command and message handlers"""
         self.application.add_handler(CommandHandler("start", self.start_command))
@@ -92,44 +105,31 @@ Ready to upload your CSV file! 📁
         await update.message.reply_text("📥 Processing your CSV file...")
         
         try:
-            # Download the file
+            # Download the file straight into memory
             file = await context.bot.get_file(document.file_id)
+            buffer = io.BytesIO()
+            await file.download_to_memory(out=buffer)
+            buffer.seek(0)
+            
+            # Parse in-process rather than re-uploading to our own API
+            stream = io.TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+            columns = await asyncio.to_thread(parse_csv_columns, stream, MAX_CONTACTS)
+            
+            if not contact_count(columns):
+                await update.message.reply_text("❌ Error processing CSV: No valid contacts found in CSV")
+                return
             
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as temp_file:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(file.file_path) as response:
-                        content = await response.read()
-                        temp_file.write(content)
-                        temp_file_path = temp_file.name
+            session_id = create_review_session(columns)
             
-            # Upload to our API
-            async with aiohttp.ClientSession() as session:
-                with open(temp_file_path, 'rb') as f:
-                    data = aiohttp.FormData()
-                    data.add_field('file', f, filename=document.file_name)
-                    
-                    async with session.post(f"{API_BASE_URL}/upload-csv", data=data) as response:
-                        if response.status == 200:
-                            result = await response.json()
-                            
-                            # Store session for this user
-                            user_sessions[user_id] = {
-                                'session_id': result['session_id'],
-                                'contacts': result['contacts'],
-                                'total_contacts': result['total_contacts'],
-                                'current_index': 0
-                            }
-                            
-                            # Clean up temp file
-                            os.unlink(temp_file_path)
-                            
-                            # Show first contact for review
-                            await self.show_contact_for_review(update, context, user_id)
-                        else:
-                            error_text = await response.text()
-                            await update.message.reply_text(f"❌ Error processing CSV: {error_text}")
-                            os.unlink(temp_file_path)
+            # Store session for this user
+            user_sessions[user_id] = {
+                'session_id': session_id,
+                'total_contacts': contact_count(columns),
+                'current_index': 0
+            }
+            
+            # Show first contact for review
+            await self.show_contact_for_review(update, context, user_id)
         
         except Exception as e:
             logger.error(f"Error handling document: {e}")
@@ -149,15 +149,14 @@ Ready to upload your CSV file! 📁
             del user_sessions[user_id]
             return
         
-        # Get contact details from API
-        async with aiohttp.ClientSession() as session_client:
-            async with session_client.get(f"{API_BASE_URL}/contacts/{session['session_id']}") as response:
-                if response.status == 200:
-                    result = await response.json()
-                    contact = result['contacts'][current_index]
-                else:
-                    await update.message.reply_text("❌ Error loading contact details")
-                    return
+        # Read the row straight from the in-process review session
+        columns = get_review_session(session['session_id'])
+        if columns is None:
+            del user_sessions[user_id]
+            # Also reached from button presses, where update.message is None
+            await update.effective_message.reply_text(SESSION_EXPIRED_MESSAGE)
+            return
+        contact = contact_row(columns, current_index)
         
         # Create contact display message
         contact_text = f"""
@@ -205,17 +204,21 @@ Ready to upload your CSV file! 📁
             await query.edit_message_text("⚠️ This contact has already been processed. Please continue with the current contact.")
             return
         
+        columns = get_review_session(session['session_id'])
+        if columns is None:
+            del user_sessions[user_id]
+            await query.edit_message_text(SESSION_EXPIRED_MESSAGE)
+            return
+        contact = contact_row(columns, contact_index)
+        
         # Process the action
         results = {}
         
-        if action in ['mailchimp', 'both']:
-            results['mailchimp'] = await self.add_contact_to_service(user_id, contact_index, 'mailchimp')
-        
-        if action in ['pipedrive', 'both']:
-            results['pipedrive'] = await self.add_contact_to_service(user_id, contact_index, 'pipedrive')
+        if action in ['mailchimp', 'pipedrive', 'both']:
+            results = await self.add_contact_to_services(user_id, contact_index, action)
         
         # Show results
-        result_text = f"📊 **Results for {session['contacts'][contact_index]['name']}:**\n\n"
+        result_text = f"📊 **Results for {contact['name']}:**\n\n"
         
         if 'mailchimp' in results:
             status = "✅ Added" if results['mailchimp'] else "❌ Failed"
@@ -226,16 +229,16 @@ Ready to upload your CSV file! 📁
             result_text += f"**Pipedrive:** {status}\n"
         
         if action == 'skip':
-            result_text = f"⏭️ **Skipped:** {session['contacts'][contact_index]['name']}"
+            result_text = f"⏭️ **Skipped:** {contact['name']}"
         
         await query.edit_message_text(result_text, parse_mode='Markdown')
         
-        # Move to next contact
+        # Move to next contact, re-inserting to restart the session's expiry
         session['current_index'] += 1
+        user_sessions[user_id] = session
         
         # Show next contact or completion message
         if session['current_index'] < session['total_contacts']:
-            await asyncio.sleep(1)  # Brief pause
             await self.show_contact_for_review(update, context, user_id)
         else:
             await context.bot.send_message(
@@ -245,32 +248,38 @@ Ready to upload your CSV file! 📁
             )
             del user_sessions[user_id]
     
-    async def add_contact_to_service(self, user_id: int, contact_index: int, service: str) -> bool:
-        """Add contact to specified service via API"""
+    async def add_contact_to_services(self, user_id: int, contact_index: int, action: str) -> Dict[str, bool]:
+        """Add contact to the services chosen by the action via the API's review handler"""
         session = user_sessions[user_id]
+        services = ['mailchimp', 'pipedrive'] if action == 'both' else [action]
         
-        review_data = {
-            "session_id": session['session_id'],
-            "contact_index": contact_index,
-            "add_to_mailchimp": service == 'mailchimp',
-            "add_to_pipedrive": service == 'pipedrive'
-        }
+        # One review with both flags lets the handler call the services concurrently
+        review = ContactReview(
+            session_id=session['session_id'],
+            contact_index=contact_index,
+            add_to_mailchimp='mailchimp' in services,
+            add_to_pipedrive='pipedrive' in services
+        )
         
         try:
-            async with aiohttp.ClientSession() as session_client:
-                async with session_client.post(
-                    f"{API_BASE_URL}/review-contact",
-                    json=review_data
-                ) as response:
-                    if response.status == 200:
-                        result = await response.json()
-                        return result['results'].get(service, False)
-                    else:
-                        logger.error(f"Error adding to {service}: {await response.text()}")
-                        return False
+            result = await review_contact(review)
+            return {service: result['results'].get(service, False) for service in services}
         except Exception as e:
-            logger.error(f"Error adding to {service}: {e}")
-            return False
+            logger.error(f"Error adding to {', '.join(services)}: {e}")
+            return {service: False for service in services}
+    
+    async def serve(self):
+        """Poll for updates inside an already running event loop until cancelled"""
+        async with self.application:
+            await self.application.start()
+            await self.application.updater.start_polling()
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await self.application.updater.stop()
+                await self.application.stop()
+                # post_shutdown only fires from run_polling, so close the session here
+                await self._close_session(self.application)
     
     def run(self):
         """Start the bot"""